@@ -1,10 +1,19 @@
 import argparse
-from PIL import Image
-from resizeimage import resizeimage
+import contextlib
+import functools
+import importlib.util
+import io
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import PIL
+from PIL import Image, features
 import pathlib
+import multiprocessing
 from multiprocessing import Pool, cpu_count
 import time
 import shutil
+import sys
 
 
 class ProgressBar:
@@ -12,9 +21,17 @@ class ProgressBar:
     def __init__(self, end=100):
         self.end = end
         self.current = 0
+        self._last_draw = 0.0
+        self._cols = None
+        self._last_size_check = 0.0
 
     def on_result(self, result):
         self.next()
+        # Draw at most ~30 times per second, but always draw completion
+        now = time.monotonic()
+        if now - self._last_draw < 0.033 and self.current != self.end:
+            return
+        self._last_draw = now
         self.print_progress()
 
     def next(self):
@@ -24,8 +41,11 @@ class ProgressBar:
         percent = "{0:.1f}".format(100 * (self.current / float(self.end)))
         styling = '%s/%s |%s| %s%%' % (self.current, self.end, fill, percent)
         if autosize:
-            cols, _ = shutil.get_terminal_size(fallback=(length, 1))
-            length = cols - len(styling)
+            now = time.monotonic()
+            if self._cols is None or now - self._last_size_check >= 1:
+                self._cols, _ = shutil.get_terminal_size(fallback=(length, 1))
+                self._last_size_check = now
+            length = self._cols - len(styling)
         filled_length = int(length * self.current // self.end)
         bar = fill * filled_length + '-' * (length - filled_length)
         print('\r%s' % styling.replace(fill, bar), end='\r')
@@ -34,6 +54,27 @@ class ProgressBar:
             print()
 
 
+def check_pillow_simd():
+    # Pillow-SIMD releases are tagged with a ".postN" suffix
+    if "post" not in PIL.__version__:
+        print("Warning: Pillow {0} detected, install Pillow-SIMD for faster resizing".format(PIL.__version__))
+
+
+def check_libjpeg_turbo():
+    if not features.version('libjpeg_turbo'):
+        print("Warning: Pillow isn't linked against libjpeg-turbo, JPEG decoding and encoding will be slower")
+
+
+def thumbnail_size(value):
+    try:
+        width, height = (int(dimension) for dimension in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Size '{0}' must be formatted as WIDTHxHEIGHT".format(value))
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError("Size '{0}' must have positive dimensions".format(value))
+    return width, height
+
+
 def open_dir(path):
     directory = pathlib.Path(path)
     if directory.is_dir():
@@ -48,23 +89,50 @@ def open_file(path):
     raise argparse.ArgumentTypeError("File '{0}' doesn't exist or isn't a file".format(path))
 
 
-def worker(path, directory, outdir, width, height, verbose):
-    resize_image(path, directory, outdir, width=width, height=height, verbose=verbose)
+def worker(path, directory, outdir, width, height, verbose, backend, strip_metadata, fast):
+    resize_image(path, directory, outdir, width=width, height=height, verbose=verbose, backend=backend,
+                 strip_metadata=strip_metadata, fast=fast)
+
+
+def try_worker(path, *args):
+    # Returns the error message instead of raising, so one bad image doesn't stop the others
+    try:
+        worker(path, *args)
+    except Exception as error:
+        return "{0}: {1}".format(type(error).__name__, error)
+    return None
+
+
+# Arguments shared by all the images of a process pool, set once per process by init_worker
+worker_args = ()
+# Set while images are resized by a pool, which already resizes them in parallel
+pooled = False
+
+
+def init_worker(directory, outdir, width, height, verbose, backend, strip_metadata, fast):
+    global worker_args, pooled
+    worker_args = (directory, outdir, width, height, verbose, backend, strip_metadata, fast)
+    pooled = True
+
+
+def path_worker(path):
+    return path, try_worker(path, *worker_args)
 
 
 def resize_dir(directory: pathlib.Path, outdir: pathlib.Path, recursive=False, width=None, height=None, ext="jpg",
-               no_progress=False, verbose=False):
+               no_progress=False, verbose=False, procs=False, backend="pillow", strip_metadata=False, fast=False,
+               gpu=False):
+    global pooled
+    if gpu:
+        # GPU output has no metadata and EXIF orientation applied, images resized on CPU are made alike
+        strip_metadata = True
     if verbose:
         print("Searching {0}{1} files in directory {2}"
               .format("recursively " if recursive else "", ext, directory.resolve()))
     if recursive:
-        generator = directory.glob('**/*.{0}'.format(ext))
+        paths = list(directory.rglob('*.{0}'.format(ext)))
     else:
-        generator = directory.glob('*.{0}'.format(ext))
-
-    paths = []
-    for path in generator:
-        paths.append(path)
+        paths = list(directory.glob('*.{0}'.format(ext)))
 
     total = len(paths)
     print("{0} image{1} to resize".format(total, "s" if total > 1 else ""))
@@ -79,42 +147,217 @@ def resize_dir(directory: pathlib.Path, outdir: pathlib.Path, recursive=False, w
             progress = ProgressBar(end=total)
             cb = progress.on_result
 
+        failures = []
+
+        def on_done(path, error):
+            if error:
+                failures.append(path)
+                print("Couldn't resize {0}: {1}".format(path, error))
+            if cb:
+                cb(None)
+
         if verbose:
             print("Starting files process")
 
         start = time.time()
 
-        p = Pool(cpu_count())
-        for path in paths:
-            p.apply_async(worker, args=(path, directory, outdir, width, height, verbose), callback=cb)
-        p.close()
-        p.join()
+        make_output_dirs(paths, directory, outdir)
+
+        # Start with the largest images so slow ones don't end up alone at the end
+        paths.sort(key=file_size, reverse=True)
+
+        if gpu and total >= gpu_resizer().BATCH_SIZE:
+            # Transfers to the GPU only pay off for large batches
+            gpu_resizer().resize_jpegs(paths, lambda size: target_size(size, width=width, height=height),
+                                       lambda path: output_path(path, directory, outdir), on_done,
+                                       lambda path: try_worker(path, directory, outdir, width, height, verbose,
+                                                               backend, strip_metadata, fast),
+                                       verbose=verbose)
+        elif total <= 1 or cpu_count() == 1:
+            # Not worth paying for a pool setup
+            for path in paths:
+                on_done(path, try_worker(path, directory, outdir, width, height, verbose, backend, strip_metadata,
+                                         fast))
+        elif procs:
+            # Only paths are sent to the processes, the other arguments are given once to each one
+            initargs = (directory, outdir, width, height, verbose, backend, strip_metadata, fast)
+            with Pool(cpu_count(), initializer=init_worker, initargs=initargs) as p:
+                for path, error in p.imap_unordered(path_worker, paths, chunksize=max(1, total // (cpu_count() * 8))):
+                    on_done(path, error)
+        else:
+            # Decoding, resizing and encoding release the GIL, threads avoid pickling arguments to processes
+            pooled = True
+            try:
+                with ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+                    futures = {}
+                    for path in paths:
+                        future = executor.submit(try_worker, path, directory, outdir, width, height, verbose,
+                                                 backend, strip_metadata, fast)
+                        futures[future] = path
+                    for future in as_completed(futures):
+                        on_done(futures[future], future.result())
+            finally:
+                pooled = False
         end = time.time()
         print("Took {0:.2f} sec.".format(end - start))
+        if failures:
+            print("{0} image{1} couldn't be resized".format(len(failures), "s" if len(failures) > 1 else ""))
 
 
-def resize_image(file: pathlib.Path, indir: pathlib.Path, outdir: pathlib.Path, width=None, height=None, verbose=False):
+def file_size(path):
+    # Files that can't be read anymore sort last, their worker reports the error
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def output_path(file, indir, outdir):
+    return outdir.joinpath(file.relative_to(indir))
+
+
+def make_output_dirs(paths, indir, outdir):
+    # Done once before resizing, so workers don't check and create the same directories concurrently
+    parents = {output_path(path, indir, outdir).parent for path in paths}
+    for parent in parents:
+        parent.mkdir(parents=True, exist_ok=True)
+
+
+def target_size(size, width=None, height=None):
+    src_width, src_height = size
+    if width and height:
+        ratio = min(width / src_width, height / src_height)
+    elif width:
+        ratio = width / src_width
+    else:
+        ratio = height / src_height
+    # Given dimensions are maximums, images are never enlarged
+    ratio = min(ratio, 1)
+    return max(1, round(src_width * ratio)), max(1, round(src_height * ratio))
+
+
+@functools.lru_cache(maxsize=None)
+def gpu_resizer():
+    # Imported on first use only, importing cupy and cucim takes a while
+    try:
+        import resizers_gpu
+    except ImportError:
+        return None
+    return resizers_gpu
+
+
+def reducing_gap_for(mode, reducing_gap):
+    # Pillow already skips box reduction of 1 and P images. Special modes such as I;16 can't be box-reduced either:
+    # Pillow 9 can't Lanczos-resize them at all, but Pillow 11, which can, would fail while reducing them
+    return None if ';' in mode else reducing_gap
+
+
+def numba_installed():
+    return all(importlib.util.find_spec(name) is not None for name in ('numba', 'numpy'))
+
+
+@functools.lru_cache(maxsize=None)
+def numba_resizer():
+    # Imported on first use only, as compiling or loading numba kernels takes a while
+    if not numba_installed():
+        return None
+    import resizers_numba
+    return resizers_numba
+
+
+def numba_resizer_for(mode, backend="pillow"):
+    # Pillow SIMD kernels don't apply to 32-bit integer and float images
+    if backend != "numba" and mode not in ('I', 'F'):
+        return None
+    resizer = numba_resizer()
+    if resizer is None or mode not in resizer.SUPPORTED_MODES:
+        return None
+    return resizer
+
+
+EXIF_ORIENTATION = 0x0112
+# Transposition applying each EXIF orientation other than 1, the normal one
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+# Image.info keys of metadata blobs written back by some encoders
+METADATA_KEYS = ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp')
+
+# Files bigger than this are mapped in memory instead of being copied in a buffer
+MMAP_THRESHOLD = 1024 * 1024
+
+
+@contextlib.contextmanager
+def open_image(file):
+    # File is read ahead of decoding, so reads from several threads overlap with decoding in others
+    with open(file, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size > MMAP_THRESHOLD:
+            source = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            # Mapped pages are read lazily on access, ask the kernel to read them all in the background now
+            if hasattr(mmap, 'MADV_WILLNEED'):
+                source.madvise(mmap.MADV_WILLNEED)
+        else:
+            source = io.BytesIO(fp.read())
+    with source, Image.open(source) as img:
+        yield img
+
+
+def resize_image(file: pathlib.Path, indir: pathlib.Path, outdir: pathlib.Path, width=None, height=None, verbose=False,
+                 backend="pillow", strip_metadata=False, fast=False):
     assert width or height, "At least height or width must be specified"
 
     if verbose:
         print("Opening file {}".format(file))
 
-    with Image.open(file.resolve()) as img:
-        if width and height:
-            resized = resizeimage.resize_thumbnail(img, [width, height])
-        elif width:
-            resized = resizeimage.resize_width(img, width)
+    with open_image(file) as img:
+        image_format = img.format
+        # Orientation is applied to pixels when metadata is stripped, swapping dimensions for quarter turns.
+        # EXIF is parsed once here, and the image is only copied when it actually needs a transposition
+        orientation = img.getexif().get(EXIF_ORIENTATION) if strip_metadata else None
+        transposed = orientation in (5, 6, 7, 8)
+        size = img.size[::-1] if transposed else img.size
+        target_width, target_height = target_size(size, width=width, height=height)
+        if file.suffix.lower() in {'.jpg', '.jpeg'}:
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, keeping twice the target size for quality
+            # unless speed is preferred
+            draft_factor = 1 if fast else 2
+            draft_size = (target_width * draft_factor, target_height * draft_factor)
+            img.draft('RGB', draft_size[::-1] if transposed else draft_size)
+        if orientation in ORIENTATION_TRANSPOSE:
+            img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+        resizer = numba_resizer_for(img.mode, backend)
+        if resizer:
+            resized = resizer.resize(img, (target_width, target_height), parallel=not pooled)
+        elif width and height:
+            # Resizes in place, box-reducing large images first, and does nothing if the image already fits
+            img.thumbnail((width, height), Image.LANCZOS, reducing_gap=reducing_gap_for(img.mode, 2.0 if fast else 3.0))
+            resized = img
         else:
-            resized = resizeimage.resize_height(img, height)
+            # For large downscales, shrink the image with a cheap box reduction before applying Lanczos filter
+            resized = img.resize((target_width, target_height), Image.LANCZOS,
+                                 reducing_gap=reducing_gap_for(img.mode, 2.0))
 
         if verbose:
             print("File {} resized. Will save it.".format(file))
 
-        final_path = file.relative_to(indir)
-        final_path = outdir.joinpath(final_path)
-        if not final_path.parent.exists():
-            final_path.parent.mkdir(parents=True)
-        resized.save(final_path, resized.format)
+        if strip_metadata:
+            for key in METADATA_KEYS:
+                resized.info.pop(key, None)
+
+        final_path = output_path(file, indir, outdir)
+        if image_format == "JPEG":
+            # Pins Pillow's defaults rather than changing them: baseline Huffman coding stays on libjpeg-turbo
+            # SIMD path, optimize=True or progressive=True don't
+            resized.save(final_path, image_format, optimize=False, progressive=False)
+        else:
+            resized.save(final_path, image_format)
 
         if verbose:
             print("Saved resized version of {} to {}".format(file, final_path))
@@ -131,6 +374,9 @@ if __name__ == "__main__":
 
     parser.add_argument('--width', type=int, help="the maximum width for the resized image")
     parser.add_argument('--height', type=int, help="the maximum height for the resized image")
+    parser.add_argument('--fast-thumbnail', type=thumbnail_size, metavar="WxH",
+                        help="resize image(s) to fit in WxH, favoring speed over quality. Replaces --width "
+                             "and --height")
     parser.add_argument('-d', '--dir', type=open_dir, help="the directory to find images in")
     parser.add_argument('-r', '--recursive', const=True, action='store_const', default=False,
                         help="iterates over directory recursively (default: %(default)s)")
@@ -143,8 +389,33 @@ if __name__ == "__main__":
                         help="if specified, progress bar won't be displayed (default: %(default)s)")
     parser.add_argument("-v", "--verbose", action="store_const", const=True, default=False,
                         help="if specified, set the program verbose (default: %(default)s)")
+    parser.add_argument("--backend", choices=["pillow", "numba"], default="pillow",
+                        help="the library used to resize images, numba requires numba and numpy to be installed and "
+                             "is always used for 32-bit integer and float images when available (default: %(default)s)")
+    parser.add_argument("--strip-metadata", action="store_const", const=True, default=False,
+                        help="if specified, EXIF, ICC and XMP metadata aren't saved in resized images, EXIF "
+                             "orientation is applied to the image beforehand (default: %(default)s)")
+    parser.add_argument("--gpu", action="store_const", const=True, default=False,
+                        help="if specified, JPEG images of large directories are decoded, resized and encoded on "
+                             "a NVIDIA GPU, requires cupy, cucim and nvidia-nvimgcodec. Implies --strip-metadata, "
+                             "can't be used with --backend numba or --fast-thumbnail (default: %(default)s)")
+    parser.add_argument("--procs", action="store_const", const=True, default=False,
+                        help="if specified, use a process pool instead of a thread pool, for platforms where PIL "
+                             "doesn't release the GIL while saving. Processes are forked, except on Windows where "
+                             "they are spawned and slower to start (default: %(default)s)")
 
     args = parser.parse_args()
+    if args.fast_thumbnail:
+        if args.width or args.height:
+            parser.error("--fast-thumbnail can't be used with --width or --height")
+        args.width, args.height = args.fast_thumbnail
+
+    check_pillow_simd()
+    check_libjpeg_turbo()
+
+    # Forked children inherit already imported PIL modules instead of importing them again
+    multiprocessing.set_start_method('fork' if sys.platform != 'win32' else 'spawn', force=True)
+
     if not (args.width or args.height):
         parser.error('Specify at least --width or --height arguments (both can be specified)')
 
@@ -154,9 +425,23 @@ if __name__ == "__main__":
     if args.dir and args.file:
         parser.error('You must choose between --dir and --file')
 
+    if args.backend == "numba" and not numba_installed():
+        parser.error('numba backend requires numba and numpy to be installed')
+
+    if args.gpu:
+        if not args.dir or args.ext.lower() not in ["jpg", "jpeg"]:
+            parser.error('--gpu can only be used to resize JPEG images of a directory')
+        if args.backend != "pillow" or args.fast_thumbnail:
+            parser.error("--gpu can't be used with --backend numba or --fast-thumbnail")
+        if gpu_resizer() is None or not gpu_resizer().available():
+            parser.error('--gpu requires cupy, cucim, nvidia-nvimgcodec and a NVIDIA GPU')
+
     if args.dir:
         resize_dir(args.dir, args.outdir, recursive=args.recursive, width=args.width, height=args.height, ext=args.ext,
-                   no_progress=args.no_progress, verbose=args.verbose)
+                   no_progress=args.no_progress, verbose=args.verbose, procs=args.procs, backend=args.backend,
+                   strip_metadata=args.strip_metadata, fast=bool(args.fast_thumbnail), gpu=args.gpu)
     else:
+        make_output_dirs([args.file], pathlib.Path('.'), args.outdir)
         resize_image(args.file, pathlib.Path('.'), args.outdir, width=args.width, height=args.height,
-                     verbose=args.verbose)
+                     verbose=args.verbose, backend=args.backend, strip_metadata=args.strip_metadata,
+                     fast=bool(args.fast_thumbnail))
@@ -0,0 +1,132 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cupy
+from cucim.skimage.transform import resize as cucim_resize
+from nvidia import nvimgcodec
+
+# Number of JPEGs decoded and encoded together on the GPU
+BATCH_SIZE = 64
+
+
+def available():
+    try:
+        return cupy.cuda.runtime.getDeviceCount() > 0
+    except cupy.cuda.runtime.CUDARuntimeError:
+        return False
+
+
+def read_file(path):
+    # Unreadable files are left to the CPU fallback, which reports the error
+    try:
+        return path.read_bytes()
+    except OSError:
+        return None
+
+
+def read_batches(paths, batches, io_executor):
+    try:
+        for start in range(0, len(paths), BATCH_SIZE):
+            batch = paths[start:start + BATCH_SIZE]
+            batches.put((batch, list(io_executor.map(read_file, batch))))
+    except Exception as error:
+        batches.put(error)
+    finally:
+        # Always sent, so the GPU loop never waits for batches that won't come
+        batches.put(None)
+
+
+def write_file(path, data):
+    with open(path, 'wb') as fp:
+        fp.write(data)
+
+
+def decode_batch(decoder, batch, data):
+    readable = [(path, item) for path, item in zip(batch, data) if item is not None]
+    if not readable:
+        return [None] * len(batch)
+    decoded = dict(zip((path for path, _ in readable), decoder.decode([item for _, item in readable])))
+    return [decoded.get(path) for path in batch]
+
+
+def resize_image(image, size_for):
+    pixels = cupy.asarray(image)
+    src_height, src_width = pixels.shape[:2]
+    width, height = size_for((src_width, src_height))
+    resized = cucim_resize(pixels, (height, width), order=3, anti_aliasing=True, preserve_range=True)
+    resized = cupy.clip(cupy.rint(resized), 0, 255).astype(cupy.uint8)
+    return nvimgcodec.as_image(cupy.ascontiguousarray(resized))
+
+
+# Decode, resize and encode JPEGs on the GPU while a pool of threads reads and writes files.
+# size_for gives the (width, height) to resize an image of given (width, height) to, and
+# output_for gives the path to save the resized version of an input path to.
+# on_done is called with each path and its error message, or None, once the image is processed.
+# fallback resizes an image on the CPU, returning its error message or None, it's used for the
+# images that couldn't be read, decoded or encoded on the GPU.
+def resize_jpegs(paths, size_for, output_for, on_done, fallback, verbose=False, io_workers=4):
+    decoder = nvimgcodec.Decoder()
+    encoder = nvimgcodec.Encoder()
+    # Small bound keeps reading ahead of the GPU without loading the whole directory in memory
+    batches = queue.Queue(maxsize=2)
+
+    def finish_writes(writes):
+        for path, write in writes:
+            error = write.exception()
+            on_done(path, "{0}: {1}".format(type(error).__name__, error) if error else None)
+
+    with ThreadPoolExecutor(max_workers=io_workers) as io_executor:
+        reader = threading.Thread(target=read_batches, args=(paths, batches, io_executor), daemon=True)
+        reader.start()
+
+        writes = []
+        item = batches.get()
+        while item is not None:
+            if isinstance(item, Exception):
+                raise item
+            batch, data = item
+            if verbose:
+                print("Resizing {0} images on GPU".format(len(batch)))
+
+            # Any GPU error, such as running out of device memory on a huge image, sends images to the CPU fallback
+            failed_paths = []
+            resized_paths = []
+            resized_images = []
+            try:
+                decoded_images = decode_batch(decoder, batch, data)
+            except Exception:
+                decoded_images = [None] * len(batch)
+            for path, image in zip(batch, decoded_images):
+                if image is None:
+                    failed_paths.append(path)
+                    continue
+                try:
+                    resized_images.append(resize_image(image, size_for))
+                except Exception:
+                    failed_paths.append(path)
+                    continue
+                resized_paths.append(path)
+
+            batch_writes = []
+            try:
+                encoded_images = encoder.encode(resized_images, "jpeg") if resized_images else []
+            except Exception:
+                encoded_images = [None] * len(resized_paths)
+            for path, encoded in zip(resized_paths, encoded_images):
+                if encoded is None:
+                    failed_paths.append(path)
+                else:
+                    batch_writes.append((path, io_executor.submit(write_file, output_for(path), encoded)))
+
+            for path in failed_paths:
+                if verbose:
+                    print("Couldn't resize {} on GPU, resizing it on CPU".format(path))
+                on_done(path, fallback(path))
+            # Previous batch had the time to be written while this one was processed
+            finish_writes(writes)
+            writes = batch_writes
+            item = batches.get()
+
+        reader.join()
+        finish_writes(writes)
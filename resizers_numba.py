@@ -0,0 +1,116 @@
+import functools
+import math
+
+import numba
+import numpy as np
+from PIL import Image
+
+# Modes whose pixels can be filtered as plain numbers, one value per channel
+SUPPORTED_MODES = {'L', 'RGB', 'RGBA', 'I', 'F'}
+
+
+def lanczos(x, a=3):
+    return np.where(np.abs(x) < a, np.sinc(x) * np.sinc(x / a), 0.0)
+
+
+# Weights and first source pixel used to compute each destination pixel along one axis
+@functools.lru_cache(maxsize=64)
+def lanczos_coefficients(src_size, dst_size, a=3):
+    scale = src_size / dst_size
+    filter_scale = max(scale, 1.0)
+    support = a * filter_scale
+    ksize = min(int(math.ceil(support)) * 2 + 1, src_size)
+
+    taps = np.zeros((dst_size, ksize), dtype=np.float32)
+    offsets = np.empty(dst_size, dtype=np.int32)
+    for x in range(dst_size):
+        center = (x + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), src_size)
+        weights = lanczos((np.arange(xmin, xmax) - center + 0.5) / filter_scale)
+        total = weights.sum()
+        if total:
+            weights /= total
+        # Shift window near the right border so the kernel never reads past the source
+        offset = min(xmin, src_size - ksize)
+        taps[x, xmin - offset:xmax - offset] = weights
+        offsets[x] = offset
+    return taps, offsets
+
+
+@numba.njit(cache=True, fastmath=True)
+def resize_row_horizontal(src, y, taps, offsets, dst):
+    for x in range(dst.shape[1]):
+        offset = offsets[x]
+        for c in range(src.shape[2]):
+            acc = np.float32(0.0)
+            for k in range(taps.shape[1]):
+                acc += taps[x, k] * src[y, offset + k, c]
+            dst[y, x, c] = acc
+
+
+@numba.njit(cache=True, fastmath=True)
+def resize_row_vertical(src, y, taps, offsets, dst):
+    offset = offsets[y]
+    for x in range(dst.shape[1]):
+        for c in range(src.shape[2]):
+            acc = np.float32(0.0)
+            for k in range(taps.shape[1]):
+                acc += taps[y, k] * src[offset + k, x, c]
+            dst[y, x, c] = acc
+
+
+# Signatures are given so kernels are compiled at import instead of on first call
+SIGNATURE = 'void(float32[:,:,::1], float32[:,::1], int32[::1], float32[:,::1], int32[::1], float32[:,:,::1])'
+
+
+@numba.njit(SIGNATURE, parallel=True, cache=True, fastmath=True)
+def resize_separable_parallel(src, taps_h, off_h, taps_v, off_v, dst):
+    tmp = np.empty((src.shape[0], dst.shape[1], src.shape[2]), dtype=np.float32)
+    for y in numba.prange(src.shape[0]):
+        resize_row_horizontal(src, y, taps_h, off_h, tmp)
+    for y in numba.prange(dst.shape[0]):
+        resize_row_vertical(tmp, y, taps_v, off_v, dst)
+
+
+# For callers already resizing several images at once: parallel kernels would start their own threads for every
+# caller, and numba's workqueue threading layer aborts when they're called from several threads
+@numba.njit(SIGNATURE, cache=True, fastmath=True)
+def resize_separable_serial(src, taps_h, off_h, taps_v, off_v, dst):
+    tmp = np.empty((src.shape[0], dst.shape[1], src.shape[2]), dtype=np.float32)
+    for y in range(src.shape[0]):
+        resize_row_horizontal(src, y, taps_h, off_h, tmp)
+    for y in range(dst.shape[0]):
+        resize_row_vertical(tmp, y, taps_v, off_v, dst)
+
+
+# Resize img to size (width, height) with a Lanczos filter, img mode must be in SUPPORTED_MODES
+def resize(img, size, parallel=True):
+    # Always a writeable copy, asarray returns Pillow's read-only buffer for F images
+    src = np.array(img, dtype=np.float32)
+    if src.ndim == 2:
+        src = src[:, :, np.newaxis]
+    src = np.ascontiguousarray(src)
+    if img.mode == 'RGBA':
+        # Premultiplied like Pillow does, so colors of transparent pixels don't bleed
+        src[:, :, :3] *= src[:, :, 3:] / 255
+
+    dst_width, dst_height = size
+    taps_h, off_h = lanczos_coefficients(src.shape[1], dst_width)
+    taps_v, off_v = lanczos_coefficients(src.shape[0], dst_height)
+    dst = np.empty((dst_height, dst_width, src.shape[2]), dtype=np.float32)
+    kernel = resize_separable_parallel if parallel else resize_separable_serial
+    kernel(src, taps_h, off_h, taps_v, off_v, dst)
+
+    if img.mode == 'RGBA':
+        alpha = np.clip(dst[:, :, 3:], 0, 255)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dst[:, :, :3] = np.where(alpha > 0, dst[:, :, :3] * 255 / alpha, 0)
+    if dst.shape[2] == 1:
+        dst = dst[:, :, 0]
+    if img.mode == 'F':
+        return Image.fromarray(dst, 'F')
+    if img.mode == 'I':
+        return Image.fromarray(np.rint(dst).astype(np.int32), 'I')
+    return Image.fromarray(np.clip(np.rint(dst), 0, 255).astype(np.uint8), img.mode)
+
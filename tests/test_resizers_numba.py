@@ -0,0 +1,53 @@
+import pathlib
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("numba")
+Image = pytest.importorskip("PIL.Image")
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import resizers_numba  # noqa: E402
+
+
+def pattern(height, width):
+    y, x = np.mgrid[0:height, 0:width]
+    return 127.5 + 100 * np.sin(x / 7) * np.cos(y / 5)
+
+
+def make_image(mode, height=75, width=100):
+    values = pattern(height, width)
+    if mode == 'L':
+        return Image.fromarray(np.rint(values).astype(np.uint8), 'L')
+    if mode == 'RGB':
+        channels = [values, values[::-1], values[:, ::-1]]
+        return Image.fromarray(np.rint(np.dstack(channels)).astype(np.uint8), 'RGB')
+    if mode == 'RGBA':
+        channels = [values, values[::-1], values[:, ::-1], 128 + values / 2]
+        return Image.fromarray(np.rint(np.dstack(channels)).astype(np.uint8), 'RGBA')
+    if mode == 'I':
+        return Image.fromarray(np.rint(values * 100).astype(np.int32), 'I')
+    return Image.fromarray(values.astype(np.float32), 'F')
+
+
+# Pillow rounds and clips 8-bit images between its two passes, so results may differ slightly
+TOLERANCES = {'L': 1, 'RGB': 1, 'RGBA': 3, 'I': 1, 'F': 0.01}
+
+
+@pytest.mark.parametrize("mode", sorted(resizers_numba.SUPPORTED_MODES))
+@pytest.mark.parametrize("src_size,dst_size", [((100, 75), (20, 15)), ((100, 75), (63, 47)), ((37, 600), (12, 200))])
+@pytest.mark.parametrize("parallel", [True, False])
+def test_matches_pillow(mode, src_size, dst_size, parallel):
+    img = make_image(mode, height=src_size[1], width=src_size[0])
+    expected = np.asarray(img.resize(dst_size, Image.LANCZOS), dtype=np.float64)
+    actual = np.asarray(resizers_numba.resize(img, dst_size, parallel=parallel), dtype=np.float64)
+    assert actual.shape == expected.shape
+    assert np.abs(expected - actual).max() <= TOLERANCES[mode]
+
+
+def test_keeps_mode_and_size():
+    for mode in resizers_numba.SUPPORTED_MODES:
+        resized = resizers_numba.resize(make_image(mode), (40, 30))
+        assert resized.mode == mode
+        assert resized.size == (40, 30)